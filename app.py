@@ -1,102 +1,326 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+import hashlib
+import heapq
 import json
 import os
 import re # For keyword extraction and ID matching
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 # Updated OpenAI import for v1.x+
 from openai import OpenAI, AuthenticationError, RateLimitError, OpenAIError
 
+try:
+    import orjson # Much faster JSON serialization; falls back to the json module if absent
+except ImportError:
+    orjson = None
+
+try:
+    from flask_compress import Compress # Optional gzip/Brotli response compression
+except ImportError:
+    Compress = None
+
 # --- Requests and BeautifulSoup Imports ---
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+try:
+    import lxml # noqa: F401 -- C parser, much faster than html.parser
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+try:
+    import pyarrow.parquet as pq # Optional: loads the Parquet copy of the grant data written by extract_grants.py
+except ImportError:
+    pq = None
+
+try:
+    import tiktoken # Exact token counts for context budgeting; falls back to a character estimate
+except ImportError:
+    tiktoken = None
 
 # --- Configuration ---
 GRANT_DATA_PATH = os.path.join("scripts", "grant_data", "independent_school_district_grants_search_combined.json")
+GRANT_PARQUET_PATH = os.path.splitext(GRANT_DATA_PATH)[0] + ".parquet" # Preferred when present and pyarrow is installed
 # --- Path for Simulated Financial Data ---
 FINANCIAL_DATA_PATH = os.path.join("data", "simulated_financial_data.json") # Assuming it's in a 'data' subfolder
 
 MAX_CONTEXT_GRANTS = 5 # Limit grants selected by keyword
 MAX_HISTORY_LENGTH = 10 # Limit history turns sent to LLM
-MAX_FETCHED_CONTENT_LENGTH = 4000 # Limit characters sent from fetched page
 REQUESTS_TIMEOUT = 15 # Seconds to wait for HTTP request
+MAX_FETCHED_BYTES = 262144 # Stop reading a page after 256 KB; its text is far more than MAX_CONTEXT_TOKENS needs
+FETCH_CACHE_MAX_ENTRIES = 256 # Limit number of fetched pages kept in memory
+FETCH_CACHE_TTL = 900 # Seconds before a fetched page is fetched again
+OPENAI_CACHE_MAX_ENTRIES = 1024 # Limit cached OpenAI answers kept in memory
+OPENAI_CACHE_TTL = 3600 # Seconds an answer to an identical prompt is reused
+INDEX_CACHE_MAX_AGE = 300 # Seconds browsers may reuse the HTML page without revalidating
+
+# --- LLM Token Budget ---
+OPENAI_MODEL = "gpt-3.5-turbo"
+MAX_RESPONSE_TOKENS = 800 # Increased slightly for potentially more complex answers
+MAX_CONTEXT_TOKENS = 2500 # Shared budget for grant JSON + fetched page text in one prompt
+MAX_HISTORY_TOKENS = 1000 # Earlier turns are dropped, oldest first, once their content exceeds this
+# Fields sent to the LLM for each grant; the rest (eligibility codes, CFDA numbers, ...) only cost tokens
+LLM_GRANT_FIELDS = ("opportunityID", "opportunityTitle", "agencyName", "closeDate", "awardCeiling", "link", "opportunityCategory")
+MAX_GRANT_DESCRIPTION_CHARS = 400 # Descriptions are the longest field; keep only the start
+MAX_CONCURRENT_OPENAI_REQUESTS_PER_PROCESS = 10 # Calls beyond this wait for a free slot; each server process has its own limit
+OPENAI_MAX_RETRIES = 4 # The client retries 429/5xx with exponential backoff, honouring Retry-After
+MAX_BATCH_QUESTIONS = 10 # Limit questions answered by one /chat_batch completion
+MAX_BATCH_RESPONSE_TOKENS = 4000 # Cap on the combined answer length for a batch
+MAX_BATCH_CONTEXT_TOKENS = 6000 # Grant context budget for a whole batch, split evenly across its questions
+
+# --- Keyword and ID Matching ---
+_WORD_RE = re.compile(r'\b\w+\b')
+_ID_RE = re.compile(r'\b(\d{6,7})\b') # Assumes Opportunity IDs are 6-7 digits
+# Includes financial terms that are too generic for keyword search
+_STOP_WORDS = frozenset({"a", "an", "the", "is", "are", "in", "on", "for", "of", "and", "to", "what", "who", "tell", "me", "about", "grant", "grants", "more", "details", "detail", "help", "write", "financial", "budget", "funding"})
 
 # --- OpenAI API Setup ---
 try:
-    client = OpenAI()
+    client = OpenAI(max_retries=OPENAI_MAX_RETRIES)
 except Exception as e:
      print(f"Error initializing OpenAI client: {e}. OpenAI calls will likely fail.")
      client = None
+# Shared by the request threads of this process only. Under gunicorn the server-wide number of calls
+# in flight is also bounded by workers x threads; the client's max_retries backs off on 429s either way.
+openai_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_OPENAI_REQUESTS_PER_PROCESS)
+
+# --- JSON Helpers ---
+def load_json_file(path):
+    """Parses a JSON file from raw bytes, using orjson when available (orjson errors subclass json.JSONDecodeError)."""
+    with open(path, 'rb') as f:
+        raw_bytes = f.read()
+    if orjson is not None:
+        return orjson.loads(raw_bytes)
+    return json.loads(raw_bytes)
+
+def load_grant_records(json_path, parquet_path):
+    """
+    Loads the grant list, preferring the Parquet copy when pyarrow is installed.
+    The JSON file is used when the Parquet file is missing, older than it, or unreadable.
+    """
+    if pq is not None and os.path.exists(parquet_path) and \
+            (not os.path.exists(json_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(json_path)):
+        print(f"Loading grant data from Parquet file: {parquet_path}")
+        try:
+            return pq.read_table(parquet_path).to_pylist()
+        except Exception as e: # Corrupt or incompatible file; the JSON is the source of truth
+            print(f"Could not read Parquet file {parquet_path}: {e}. Loading the JSON file instead.")
+    return load_json_file(json_path)
+
+def to_compact_json(obj) -> str:
+    """Serializes obj without indentation; whitespace only costs tokens for the LLM."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+# --- Token Counting ---
+token_encoding = None
+if tiktoken is not None:
+    try:
+        token_encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+    except Exception as e: # Encoding files are downloaded on first use and may be unavailable
+        print(f"Could not load tiktoken encoding for {OPENAI_MODEL}: {e}. Using character-based token estimates.")
+
+def count_tokens(text):
+    if not text: return 0
+    if token_encoding is not None:
+        return len(token_encoding.encode(text, disallowed_special=())) # Count '<|endoftext|>' typed by users as text, don't raise
+    return len(text) // 4 + 1 # Roughly 4 characters per token for English text
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0: return ""
+    if token_encoding is not None:
+        tokens = token_encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else token_encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+_LINE_BREAK_RE = re.compile(r'\s*\n\s*') # A line break plus any surrounding whitespace/blank lines
+_INLINE_WS_RE = re.compile(r'[^\S\n]+') # Runs of whitespace other than line breaks
+
+def truncate_at_line_boundary(text, max_tokens):
+    """
+    Collapses whitespace in extracted page text, then keeps whole lines (BS4 puts one text block per line)
+    until max_tokens is reached. Only a first line that alone exceeds the budget is cut mid-line.
+    """
+    text = _INLINE_WS_RE.sub(' ', _LINE_BREAK_RE.sub('\n', text.strip()))
+    kept_lines = []
+    tokens_used = 0
+    for line in text.split('\n'):
+        line_tokens = count_tokens(line) + 1 # +1 for the joining newline
+        if tokens_used + line_tokens > max_tokens:
+            if not kept_lines:
+                return truncate_to_tokens(line, max_tokens)
+            break
+        kept_lines.append(line)
+        tokens_used += line_tokens
+    return '\n'.join(kept_lines)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
+if Compress is not None:
+    app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+    app.config["COMPRESS_STREAMS"] = False # Compressing would buffer /chat/stream and delay the first words
+    Compress(app)
 
 # --- Global Variables for Data ---
 grant_data = []
 grant_data_by_id = {}
+grant_keyword_index = {} # keyword -> set of indices into grant_data, built once after load
 # --- Load Simulated Financial Data ---
 simulated_financial_data = None
-try:
-    base_dir = os.path.dirname(os.path.abspath(__file__)) # Get the directory where app.py is located
-
-    # Load Grant Data
-    absolute_grant_data_path = os.path.join(base_dir, GRANT_DATA_PATH)
-    print(f"Attempting to load grant data from: {absolute_grant_data_path}")
-    with open(absolute_grant_data_path, 'r', encoding='utf-8') as f:
-        grant_data = json.load(f)
-        for grant_item in grant_data: # Renamed to avoid conflict with module name
-            if grant_item.get("opportunityID"):
-                 grant_data_by_id[grant_item["opportunityID"]] = grant_item
-    print(f"Successfully loaded {len(grant_data)} grant records.")
-
-    # Load Simulated Financial Data
-    absolute_financial_data_path = os.path.join(base_dir, FINANCIAL_DATA_PATH)
-    print(f"Attempting to load simulated financial data from: {absolute_financial_data_path}")
-    with open(absolute_financial_data_path, 'r', encoding='utf-8') as f:
-        simulated_financial_data = json.load(f)
-    print("Successfully loaded simulated financial data.")
-
-except FileNotFoundError as e:
-    # Check which file was not found by comparing the error message with the paths
-    if GRANT_DATA_PATH in str(e) or absolute_grant_data_path in str(e): # Check both relative and absolute
-        print(f"Error: Grant data file not found. Path checked: {absolute_grant_data_path}. Grant context will be limited.")
-    elif FINANCIAL_DATA_PATH in str(e) or absolute_financial_data_path in str(e): # Check both relative and absolute
-        print(f"Error: Simulated financial data file not found. Path checked: {absolute_financial_data_path}. Financial context will be missing.")
-        # Allow app to run without financial data, but it won't be used
-    else:
-        print(f"Error: A data file was not found: {e}")
-except json.JSONDecodeError as e:
-    print(f"Error: Could not decode JSON from a data file. Check file integrity. Error: {e}")
-except Exception as e:
-    print(f"An unexpected error occurred loading data: {e}")
+financial_context_str = "" # Serialized once at load; the data never changes between requests
+data_ready = threading.Event() # Set by load_all_data once the loading attempt has finished
+
+
+# --- Thread-Safe LRU Cache with Expiry ---
+class TTLCache:
+    """Keeps up to maxsize entries for ttl seconds, evicting the least recently used entry first."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+fetched_content_cache = TTLCache(FETCH_CACHE_MAX_ENTRIES, FETCH_CACHE_TTL) # grant link -> extracted page text
+# Fetches currently in progress, so concurrent requests for the same link share one download
+_inflight_fetches = {} # grant link -> Future resolving to the fetch result
+_inflight_fetches_lock = threading.Lock()
+
+# Answers keyed by a hash of the exact messages sent (system prompt, history, question and context)
+openai_response_cache = TTLCache(OPENAI_CACHE_MAX_ENTRIES, OPENAI_CACHE_TTL)
+
+def openai_cache_key(messages_for_api):
+    return hashlib.sha256(to_compact_json(messages_for_api).encode('utf-8')).hexdigest()
+
+# --- Shared HTTP Session (reuses TCP/TLS connections across fetches) ---
+_http_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+http_session = requests.Session()
+http_session.mount("https://", _http_adapter)
+http_session.mount("http://", _http_adapter)
+# Only build the tags we extract text from; skips <head>, scripts, styles etc.
+CONTENT_STRAINER = SoupStrainer(['main', 'article', 'body', 'div'])
+# Parsing is CPU-bound; a pool sized to the CPU count caps how many pages are parsed at once
+page_parse_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="page-parse")
 
 
 # --- Requests + BeautifulSoup Fetch Function ---
 def fetch_with_requests_bs4(url: str) -> str:
-    """Fetches page content using requests and parses with BeautifulSoup."""
-    print(f"--- Attempting to fetch with Requests+BS4: {url} ---")
+    """
+    Fetches page content using requests and parses with BeautifulSoup.
+    Successful fetches are cached per URL, and concurrent calls for the same URL share a single fetch.
+    """
+    cached_content = fetched_content_cache.get(url)
+    if cached_content is not None:
+        print(f"--- Using cached content for: {url} ---")
+        return cached_content
+
+    with _inflight_fetches_lock:
+        inflight_fetch = _inflight_fetches.get(url)
+        is_fetch_owner = inflight_fetch is None
+        if is_fetch_owner:
+            inflight_fetch = Future()
+            _inflight_fetches[url] = inflight_fetch
+    if not is_fetch_owner:
+        print(f"--- Waiting for in-progress fetch of: {url} ---")
+        return inflight_fetch.result()
+
+    try:
+        content = _fetch_with_requests_bs4_uncached(url)
+        # Only cache real page text; status/error messages are bracketed and should be retried
+        if content and not content.startswith("["):
+            # Store at most the whole context budget, cut at a line boundary; each request trims it further
+            content = truncate_at_line_boundary(content, MAX_CONTEXT_TOKENS)
+            fetched_content_cache.set(url, content)
+        inflight_fetch.set_result(content)
+        return content
+    except BaseException as e:
+        inflight_fetch.set_exception(e) # Don't leave waiting requests hanging
+        raise
+    finally:
+        with _inflight_fetches_lock:
+            _inflight_fetches.pop(url, None)
+
+def _read_capped_body(response, max_bytes):
+    """Reads at most max_bytes of a streamed response body (decompressed)."""
+    chunks = []
+    total_bytes = 0
+    for chunk in response.iter_content(chunk_size=65536):
+        chunks.append(chunk)
+        total_bytes += len(chunk)
+        if total_bytes >= max_bytes:
+            print(f"Response body reached {max_bytes} bytes; ignoring the rest of the page.")
+            break
+    return b"".join(chunks)[:max_bytes]
+
+def _download_page(url):
+    """Downloads at most MAX_FETCHED_BYTES of url. Returns (page_bytes, content_type, encoding)."""
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'x-requested-with': 'XMLHttpRequest'
     }
+    # Stream the body so large pages are never fully downloaded or held in memory
+    response = http_session.get(url, headers=headers, timeout=REQUESTS_TIMEOUT, stream=True)
     try:
-        response = requests.get(url, headers=headers, timeout=REQUESTS_TIMEOUT)
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+        page_bytes = _read_capped_body(response, MAX_FETCHED_BYTES)
+    finally:
+        response.close()
+    return page_bytes, response.headers.get('content-type', '').lower(), response.encoding
+
+def _parse_page(page_bytes):
+    """Extracts the readable text of an HTML page."""
+    soup = BeautifulSoup(page_bytes, HTML_PARSER, parse_only=CONTENT_STRAINER)
+    # Try finding a main content area first, otherwise fallback to body
+    main_content = soup.find('main') or soup.find('article') or soup.find('div', id='content') or soup.find('div', class_='content')
+    if main_content:
+        content = main_content.get_text(separator='\n', strip=True)
+        print("Extracted text from main content area.")
+    else:
+        # Fallback to getting text from the whole body
+        body = soup.find('body')
+        content = body.get_text(separator='\n', strip=True) if body else "[Could not find body tag]"
+        print("Extracted text from body (fallback).")
+    return content
+
+def _fetch_with_requests_bs4_uncached(url: str) -> str:
+    print(f"--- Attempting to fetch with Requests+BS4: {url} ---")
+    try:
+        page_bytes, content_type, encoding = _download_page(url)
 
         # Check if content type is HTML before parsing
-        content_type = response.headers.get('content-type', '').lower()
         if 'html' not in content_type:
             print(f"Warning: Content type is not HTML ({content_type}) for {url}. Returning raw text.")
-            return response.text if response.text else "[No text content returned]"
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # Try finding a main content area first, otherwise fallback to body
-        main_content = soup.find('main') or soup.find('article') or soup.find('div', id='content') or soup.find('div', class_='content')
-        if main_content:
-            content = main_content.get_text(separator='\n', strip=True)
-            print("Extracted text from main content area.")
-        else:
-            # Fallback to getting text from the whole body
-            body = soup.find('body')
-            content = body.get_text(separator='\n', strip=True) if body else "[Could not find body tag]"
-            print("Extracted text from body (fallback).")
+            page_text = page_bytes.decode(encoding or 'utf-8', errors='replace')
+            return page_text if page_text else "[No text content returned]"
+        content = page_parse_pool.submit(_parse_page, page_bytes).result()
         print(f"Requests+BS4 successfully fetched content (first 100 chars): {content[:100]}")
         return content
     except requests.exceptions.Timeout:
@@ -113,201 +337,464 @@ def fetch_with_requests_bs4(url: str) -> str:
 # --- Helper Functions for Context and ID ---
 def extract_keywords(text):
     if not text: return set()
-    words = re.findall(r'\b\w+\b', text.lower())
-    # Updated stop_words to include financial terms if they are too generic for keyword search
-    stop_words = {"a", "an", "the", "is", "are", "in", "on", "for", "of", "and", "to", "what", "who", "tell", "me", "about", "grant", "grants", "more", "details", "detail", "help", "write", "financial", "budget", "funding"}
-    return set(word for word in words if word not in stop_words and len(word) > 2)
-
-def find_opportunity_id(text, grant_lookup):
-    potential_ids = re.findall(r'\b(\d{6,7})\b', text) # Assumes Opportunity IDs are 6-7 digits
-    for pid in potential_ids:
-        if pid in grant_lookup:
-            print(f"Found potential Opportunity ID in question: {pid}")
-            return pid
-    return None
-
-def select_relevant_grants_by_keyword(question, all_grants_list, max_grants=MAX_CONTEXT_GRANTS): # Renamed all_grants to all_grants_list
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 2 and word not in _STOP_WORDS}
+
+def find_opportunity_ids(text, grant_lookup):
+    """Returns every known Opportunity ID in the text, in order of appearance and without duplicates."""
+    found_ids = list(dict.fromkeys(pid for pid in _ID_RE.findall(text) if pid in grant_lookup))
+    if found_ids:
+        print(f"Found potential Opportunity IDs in question: {found_ids}")
+    return found_ids
+
+def build_keyword_index(all_grants_list):
+    """
+    Builds an inverted index mapping each keyword to the set of grant positions containing it.
+    Also caches the per-grant LLM context so it is never rebuilt per request:
+    '_slim_json' and '_slim_tokens' for multi-grant JSON, '_compact' and '_compact_tokens' for a single grant.
+    The search text and slim projection they derive from are not kept, to save memory.
+    """
+    keyword_index = {}
+    for position, grant_item in enumerate(all_grants_list):
+        search_text = f"{grant_item.get('opportunityTitle', '')} {grant_item.get('description', '')} {grant_item.get('opportunityCategory', '')}".lower()
+        for keyword in extract_keywords(search_text): # Already a set, so each grant is added once per keyword
+            keyword_index.setdefault(keyword, set()).add(position)
+        slim_grant = {field: grant_item.get(field) for field in LLM_GRANT_FIELDS}
+        slim_grant["description"] = (grant_item.get("description") or "")[:MAX_GRANT_DESCRIPTION_CHARS]
+        grant_item["_slim_json"] = to_compact_json(slim_grant)
+        grant_item["_slim_tokens"] = count_tokens(grant_item["_slim_json"])
+        grant_item["_compact"] = format_grant_compact(grant_item)
+        grant_item["_compact_tokens"] = count_tokens(grant_item["_compact"])
+    return keyword_index
+
+def format_grant_compact(grant_item):
+    """Formats one grant as 'Key: value' lines, which costs fewer tokens than JSON."""
+    return (
+        f"ID: {grant_item.get('opportunityID') or ''}\n"
+        f"Title: {grant_item.get('opportunityTitle') or ''}\n"
+        f"Agency: {grant_item.get('agencyName') or ''}\n"
+        f"Close Date: {grant_item.get('closeDate') or ''}\n"
+        f"Award Ceiling: {grant_item.get('awardCeiling') or ''}\n"
+        f"Category: {grant_item.get('opportunityCategory') or ''}\n"
+        f"Link: {grant_item.get('link') or ''}\n"
+        f"Description: {(grant_item.get('description') or '')[:MAX_GRANT_DESCRIPTION_CHARS]}"
+    )
+
+def build_grant_context(grants, token_budget):
+    """
+    Builds the grant context for the LLM from the fields cached by build_keyword_index.
+    A single grant is sent in compact 'Key: value' form; several grants are sent as a JSON list,
+    added in order until token_budget is used up (the first grant is always kept).
+    Returns (context_str, tokens_used).
+    """
+    if len(grants) == 1:
+        return grants[0]["_compact"], grants[0]["_compact_tokens"]
+    context_grant_jsons = []
+    tokens_used = 0
+    for grant_item in grants:
+        if context_grant_jsons and tokens_used + grant_item["_slim_tokens"] > token_budget:
+            print(f"Token budget reached; sending {len(context_grant_jsons)} of {len(grants)} grants.")
+            break
+        context_grant_jsons.append(grant_item["_slim_json"])
+        tokens_used += grant_item["_slim_tokens"]
+    # Join the pre-serialized fragments; no JSON encoding happens per request
+    return "[" + ",".join(context_grant_jsons) + "]", tokens_used
+
+def select_relevant_grants_by_keyword(question, all_grants_list, keyword_index, max_grants=MAX_CONTEXT_GRANTS): # keyword_index must be built from all_grants_list
     keywords = extract_keywords(question)
     if not keywords: return []
     print(f"Keywords for search: {keywords}")
-    relevant_grants = []
-    for grant_item in all_grants_list: # Use the new parameter name
-        search_text = f"{grant_item.get('opportunityTitle', '')} {grant_item.get('description', '')} {grant_item.get('opportunityCategory', '')}".lower()
-        if any(keyword in search_text for keyword in keywords):
-            relevant_grants.append(grant_item)
-            if len(relevant_grants) >= max_grants: break
+    # Score each grant by how many question keywords it contains; grants with no match never get a score
+    keyword_match_counts = Counter()
+    for keyword in keywords:
+        keyword_match_counts.update(keyword_index.get(keyword, ()))
+    # Best matches first; ties keep file order
+    best_matches = heapq.nlargest(max_grants, keyword_match_counts.items(), key=lambda item: (item[1], -item[0]))
+    relevant_grants = [all_grants_list[position] for position, _ in best_matches]
     print(f"Found {len(relevant_grants)} relevant grants via keywords.")
     return relevant_grants
 
-# --- Helper Function for OpenAI Interaction (Updated System Prompt & Context) ---
-def get_openai_response(full_history, json_grant_context_str, fetched_web_content_status=None, internal_financial_context_str=None):
+# --- Load Data in the Background (so the server can start before large files are parsed) ---
+def load_all_data():
+    """Loads grant and financial data into the module globals, then sets data_ready."""
+    global grant_data, grant_data_by_id, grant_keyword_index, simulated_financial_data, financial_context_str
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__)) # Get the directory where app.py is located
+
+        # Load Grant Data
+        absolute_grant_data_path = os.path.join(base_dir, GRANT_DATA_PATH)
+        print(f"Attempting to load grant data from: {absolute_grant_data_path}")
+        loaded_grant_data = load_grant_records(absolute_grant_data_path, os.path.join(base_dir, GRANT_PARQUET_PATH))
+        loaded_keyword_index = build_keyword_index(loaded_grant_data)
+        # Publish the grants together with their lookup and index
+        # IDs are interned: the lookup dict is hit on every request and its keys live as long as the process
+        grant_data_by_id = {sys.intern(opportunity_id): grant_item for grant_item in loaded_grant_data if (opportunity_id := grant_item.get("opportunityID"))}
+        grant_keyword_index = loaded_keyword_index
+        grant_data = loaded_grant_data
+        print(f"Successfully loaded {len(grant_data)} grant records and indexed {len(grant_keyword_index)} keywords.")
+
+        # Load Simulated Financial Data
+        absolute_financial_data_path = os.path.join(base_dir, FINANCIAL_DATA_PATH)
+        print(f"Attempting to load simulated financial data from: {absolute_financial_data_path}")
+        loaded_financial_data = load_json_file(absolute_financial_data_path)
+        financial_context_str = to_compact_json(loaded_financial_data) if loaded_financial_data else ""
+        simulated_financial_data = loaded_financial_data
+        print("Successfully loaded simulated financial data.")
+
+    except FileNotFoundError as e:
+        # Check which file was not found by comparing the error message with the paths
+        if GRANT_DATA_PATH in str(e) or absolute_grant_data_path in str(e): # Check both relative and absolute
+            print(f"Error: Grant data file not found. Path checked: {absolute_grant_data_path}. Grant context will be limited.")
+        elif FINANCIAL_DATA_PATH in str(e) or absolute_financial_data_path in str(e): # Check both relative and absolute
+            print(f"Error: Simulated financial data file not found. Path checked: {absolute_financial_data_path}. Financial context will be missing.")
+            # Allow app to run without financial data, but it won't be used
+        else:
+            print(f"Error: A data file was not found: {e}")
+    except json.JSONDecodeError as e:
+        print(f"Error: Could not decode JSON from a data file. Check file integrity. Error: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred loading data: {e}")
+    finally:
+        data_ready.set() # Serve with whatever loaded, as before; errors were logged above
+
+def start_data_loader():
+    threading.Thread(target=load_all_data, name="data-loader", daemon=True).start()
+
+def _restart_data_loader_after_fork():
+    """A forked child gets a copy of memory but not the loader thread; if loading was unfinished, load again."""
+    if not data_ready.is_set():
+        start_data_loader()
+
+start_data_loader()
+if hasattr(os, "register_at_fork"): # POSIX only; covers servers that fork workers after importing the app
+    os.register_at_fork(after_in_child=_restart_data_loader_after_fork)
+
+# --- System Prompt for OpenAI (Updated) ---
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant for Springfield Independent School District, specializing in grant information. "
+    "Your primary goal is to answer questions about specific grants based *only* on the provided context: "
+    "the 'JSON Grant Data Context' (external grant opportunities) and the 'Fetched Webpage Content Status' (live details of a specific external grant). "
+    "You also have access to 'Internal School District Financial Context'.\n\n"
+    "RULES FOR ANSWERING ABOUT SPECIFIC EXTERNAL GRANTS:\n"
+    "* Base answers *strictly* on the provided JSON grant data and fetched web content.\n"
+    "* If 'Fetched Webpage Content Status' contains actual content, prioritize it for specific details about one grant.\n"
+    "* If 'Fetched Webpage Content Status' indicates an error or no content, inform the user you couldn't retrieve live details and rely *only* on the JSON grant data and history.\n"
+    "* If the information needed is not present in the provided context or history, clearly state that.\n"
+    "* Do not make up information or use external knowledge for external grant-specific questions.\n"
+    "* Refer to specific grants by title or ID when possible. Provide the grant link if relevant.\n\n"
+    "USING INTERNAL SCHOOL DISTRICT FINANCIAL CONTEXT:\n"
+    "* If the user's question relates to the school district's own finances, budget, needs, or how a potential grant aligns with these, "
+    "use the 'Internal School District Financial Context' to inform your answer. "
+    "For example, if asked about the district's budget for technology or what the district needs funding for.\n"
+    "* When discussing applying for a grant, you can use the internal financial context to explain why the district needs the grant or how it fits into existing priorities/budget.\n\n"
+    "EXCEPTION - GENERAL GRANT WRITING HELP:\n"
+    "* If the user explicitly asks for general help or tips on *writing* a grant, you MAY provide general advice. "
+    "This advice should be clearly marked as general. Do NOT offer to write the grant *for* the user.\n"
+    "* Keep grant writing advice concise (e.g., understanding requirements, clear objectives, budget planning, proofreading).\n\n"
+    "Always be concise and helpful. If context is missing for any part of a question, state that clearly."
+)
+
+
+# --- Helper Functions for OpenAI Interaction (Updated Context) ---
+def build_openai_messages(limited_history, user_question, json_grant_context_str, fetched_web_content_status=None, internal_financial_context_str=None):
     """
-    Sends history and various contexts to OpenAI and returns the response.
+    Builds the chat completion message list from the (already limited) earlier history,
+    the current user question and the various contexts.
     """
-    print("--- Preparing OpenAI Request ---")
-
-    if not client:
-         print("Error: OpenAI client not initialized.")
-         return "Sorry, the chatbot is not configured correctly (OpenAI client issue)."
-
-    # --- UPDATED SYSTEM PROMPT ---
-    system_prompt = (
-        "You are a helpful AI assistant for Springfield Independent School District, specializing in grant information. "
-        "Your primary goal is to answer questions about specific grants based *only* on the provided context: "
-        "the 'JSON Grant Data Context' (external grant opportunities) and the 'Fetched Webpage Content Status' (live details of a specific external grant). "
-        "You also have access to 'Internal School District Financial Context'.\n\n"
-        "RULES FOR ANSWERING ABOUT SPECIFIC EXTERNAL GRANTS:\n"
-        "* Base answers *strictly* on the provided JSON grant data and fetched web content.\n"
-        "* If 'Fetched Webpage Content Status' contains actual content, prioritize it for specific details about one grant.\n"
-        "* If 'Fetched Webpage Content Status' indicates an error or no content, inform the user you couldn't retrieve live details and rely *only* on the JSON grant data and history.\n"
-        "* If the information needed is not present in the provided context or history, clearly state that.\n"
-        "* Do not make up information or use external knowledge for external grant-specific questions.\n"
-        "* Refer to specific grants by title or ID when possible. Provide the grant link if relevant.\n\n"
-        "USING INTERNAL SCHOOL DISTRICT FINANCIAL CONTEXT:\n"
-        "* If the user's question relates to the school district's own finances, budget, needs, or how a potential grant aligns with these, "
-        "use the 'Internal School District Financial Context' to inform your answer. "
-        "For example, if asked about the district's budget for technology or what the district needs funding for.\n"
-        "* When discussing applying for a grant, you can use the internal financial context to explain why the district needs the grant or how it fits into existing priorities/budget.\n\n"
-        "EXCEPTION - GENERAL GRANT WRITING HELP:\n"
-        "* If the user explicitly asks for general help or tips on *writing* a grant, you MAY provide general advice. "
-        "This advice should be clearly marked as general. Do NOT offer to write the grant *for* the user.\n"
-        "* Keep grant writing advice concise (e.g., understanding requirements, clear objectives, budget planning, proofreading).\n\n"
-        "Always be concise and helpful. If context is missing for any part of a question, state that clearly."
-    )
-    # --- END UPDATED SYSTEM PROMPT ---
-
-    messages_for_api = [{"role": "system", "content": system_prompt}]
-    limited_history = full_history[-(MAX_HISTORY_LENGTH * 2):-1] # Get all but the last message
+    messages_for_api = [{"role": "system", "content": SYSTEM_PROMPT}]
     messages_for_api.extend(limited_history)
 
-    latest_user_message = full_history[-1] # The last message is the current user question
-    if latest_user_message['role'] != 'user':
-        print("Error: Last message in history is not from the user.")
-        return "Sorry, there was an internal error processing the conversation history."
-
     # Construct the user message content, including all relevant contexts
-    user_content_parts = [f"User Question:\n{latest_user_message['content']}"]
+    user_content_parts = [f"User Question:\n{user_question}"]
+    user_content_parts.extend(format_context_sections(json_grant_context_str, fetched_web_content_status, internal_financial_context_str))
+
+    latest_user_message_with_context = "".join(user_content_parts)
+    messages_for_api.append({"role": "user", "content": latest_user_message_with_context})
+    return messages_for_api
+
+def format_context_sections(json_grant_context_str, fetched_web_content_status=None, internal_financial_context_str=None):
+    """Returns the labelled context blocks (named as in SYSTEM_PROMPT) to append after a question."""
+    context_parts = []
     if json_grant_context_str:
-         user_content_parts.append(f"\n\nJSON Grant Data Context (External Opportunities):\n```json\n{json_grant_context_str}\n```")
+         fence_language = "json" if json_grant_context_str.startswith("[") else "" # Single grants use the compact text form
+         context_parts.append(f"\n\nJSON Grant Data Context (External Opportunities):\n```{fence_language}\n{json_grant_context_str}\n```")
     if fetched_web_content_status:
-         user_content_parts.append(f"\n\nFetched Webpage Content Status (External Opportunity Detail):\n```\n{fetched_web_content_status}\n```")
+         context_parts.append(f"\n\nFetched Webpage Content Status (External Opportunity Detail):\n```\n{fetched_web_content_status}\n```")
     # --- Add Internal Financial Context if available ---
     if internal_financial_context_str:
-        user_content_parts.append(f"\n\nInternal School District Financial Context:\n```json\n{internal_financial_context_str}\n```")
-
+        context_parts.append(f"\n\nInternal School District Financial Context:\n```json\n{internal_financial_context_str}\n```")
+    return context_parts
 
-    latest_user_message_with_context = "".join(user_content_parts)
-    messages_for_api.append({"role": "user", "content": latest_user_message_with_context})
-
-    try:
-        print(f"Sending request to OpenAI API (v1.x+) with {len(messages_for_api)} messages...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages_for_api,
-            temperature=0.5,
-            max_tokens=800, # Increased slightly for potentially more complex answers
-        )
-        assistant_response = response.choices[0].message.content.strip()
-        print(f"OpenAI Response Received: {assistant_response[:100]}...")
-        return assistant_response
-    # (Error handling remains the same)
-    except AuthenticationError as e:
+def describe_openai_error(e):
+    """Logs an OpenAI call failure and returns the message shown to the user."""
+    error_type = type(e).__name__
+    if isinstance(e, AuthenticationError):
          print(f"OpenAI Authentication Error: {e}")
          error_detail = f" ({e.body.get('message', '')})" if hasattr(e, 'body') and isinstance(e.body, dict) else ""
          return f"Sorry, there's an issue with the chatbot configuration (Authentication Error{error_detail}). Please check the API key."
-    except RateLimitError as e:
+    if isinstance(e, RateLimitError):
          print(f"OpenAI Rate Limit Error: {e}")
          return "Sorry, the chatbot is currently experiencing high traffic (Rate Limit Exceeded). Please try again later."
-    except OpenAIError as e:
-        error_type = type(e).__name__
+    if isinstance(e, OpenAIError):
         if "context_length_exceeded" in str(e).lower():
              print(f"OpenAI API Error ({error_type}): Context length exceeded. {e}")
              return "Sorry, the conversation history or the provided grant data is too long for the AI model to process. Please try starting a new topic or asking a more specific question."
         print(f"OpenAI API Error ({error_type}): {e}")
         return f"Sorry, I encountered an error trying to reach the AI model ({error_type})."
+    print(f"Generic Error calling OpenAI API ({error_type}): {e}")
+    return f"Sorry, I encountered an unexpected error ({error_type}) while processing your request."
+
+def get_openai_response(limited_history, user_question, json_grant_context_str, fetched_web_content_status=None, internal_financial_context_str=None):
+    """
+    Sends history and various contexts to OpenAI and returns the response.
+    """
+    print("--- Preparing OpenAI Request ---")
+
+    if not client:
+         print("Error: OpenAI client not initialized.")
+         return "Sorry, the chatbot is not configured correctly (OpenAI client issue)."
+
+    messages_for_api = build_openai_messages(limited_history, user_question, json_grant_context_str, fetched_web_content_status, internal_financial_context_str)
+    cache_key = openai_cache_key(messages_for_api)
+    cached_response = openai_response_cache.get(cache_key)
+    if cached_response is not None:
+        print("Returning cached OpenAI response for an identical prompt.")
+        return cached_response
+
+    try:
+        print(f"Sending request to OpenAI API (v1.x+) with {len(messages_for_api)} messages...")
+        with openai_request_slots:
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages_for_api,
+                temperature=0.5,
+                max_tokens=MAX_RESPONSE_TOKENS,
+            )
+        assistant_response = response.choices[0].message.content.strip()
+        print(f"OpenAI Response Received: {assistant_response[:100]}...")
+        openai_response_cache.set(cache_key, assistant_response) # Error messages are never cached
+        return assistant_response
+    except Exception as e:
+        return describe_openai_error(e)
+
+def stream_openai_response(limited_history, user_question, json_grant_context_str, fetched_web_content_status=None, internal_financial_context_str=None):
+    """
+    Same as get_openai_response, but yields the answer in pieces as the model generates them.
+    Errors are yielded as text, since the HTTP status has already been sent once streaming starts.
+    """
+    print("--- Preparing Streaming OpenAI Request ---")
+
+    if not client:
+         print("Error: OpenAI client not initialized.")
+         yield "Sorry, the chatbot is not configured correctly (OpenAI client issue)."
+         return
+
+    messages_for_api = build_openai_messages(limited_history, user_question, json_grant_context_str, fetched_web_content_status, internal_financial_context_str)
+    cache_key = openai_cache_key(messages_for_api)
+    cached_response = openai_response_cache.get(cache_key)
+    if cached_response is not None:
+        print("Returning cached OpenAI response for an identical prompt.")
+        yield cached_response
+        return
+
+    try:
+        print(f"Sending streaming request to OpenAI API (v1.x+) with {len(messages_for_api)} messages...")
+        with openai_request_slots: # Held until the stream is fully read
+            stream = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages_for_api,
+                temperature=0.5,
+                max_tokens=MAX_RESPONSE_TOKENS,
+                stream=True,
+            )
+            response_pieces = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    response_pieces.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        print("OpenAI streaming response complete.")
+        openai_response_cache.set(cache_key, "".join(response_pieces).strip())
     except Exception as e:
-        error_type = type(e).__name__
-        print(f"Generic Error calling OpenAI API ({error_type}): {e}")
-        return f"Sorry, I encountered an unexpected error ({error_type}) while processing your request."
+        yield describe_openai_error(e)
 
 
-# --- API Endpoint for Chat (Uses Requests+BS4 for Fetching) ---
+def get_openai_batch_answers(questions_with_context, internal_financial_context_str=None):
+    """
+    Answers several independent questions with one chat completion, so the system prompt and
+    financial context are sent once per batch instead of once per question.
+    questions_with_context is a list of (question_id, question, json_grant_context_str, fetched_web_content_status).
+    Returns a dict mapping each question_id to its answer (an error message if the call or parsing failed).
+    """
+    print(f"--- Preparing Batched OpenAI Request for {len(questions_with_context)} questions ---")
+    question_ids = [question_id for question_id, _, _, _ in questions_with_context]
+
+    if not client:
+         print("Error: OpenAI client not initialized.")
+         return dict.fromkeys(question_ids, "Sorry, the chatbot is not configured correctly (OpenAI client issue).")
+
+    user_content_parts = [
+        "Answer each of the following independent questions using only the context given with it "
+        "and the shared context at the end. Return only a JSON object that maps each question ID "
+        'to its answer as a string, for example {"1": "...", "2": "..."}.'
+    ]
+    for question_id, question, json_grant_context_str, fetched_web_content_status in questions_with_context:
+        user_content_parts.append(f"\n\n### Question {question_id}\nUser Question:\n{question}")
+        user_content_parts.extend(format_context_sections(json_grant_context_str, fetched_web_content_status))
+    if internal_financial_context_str:
+        user_content_parts.append("\n\n### Shared Context")
+        user_content_parts.extend(format_context_sections(None, None, internal_financial_context_str))
+
+    messages_for_api = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "".join(user_content_parts)},
+    ]
+    unreadable_answer = "Sorry, I couldn't read the AI model's answer for this question."
+    try:
+        print(f"Sending batched request to OpenAI API (v1.x+) with {len(question_ids)} questions...")
+        with openai_request_slots:
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages_for_api,
+                temperature=0.5,
+                max_tokens=min(MAX_RESPONSE_TOKENS * len(question_ids), MAX_BATCH_RESPONSE_TOKENS),
+                response_format={"type": "json_object"},
+            )
+        answers_by_id = json.loads(response.choices[0].message.content)
+    except json.JSONDecodeError as e:
+        print(f"Could not parse batched OpenAI response as JSON: {e}")
+        return dict.fromkeys(question_ids, unreadable_answer)
+    except Exception as e:
+        return dict.fromkeys(question_ids, describe_openai_error(e))
+    if not isinstance(answers_by_id, dict): # Valid JSON, but not the requested {id: answer} object
+        print(f"Batched OpenAI response was JSON {type(answers_by_id).__name__}, not an object.")
+        return dict.fromkeys(question_ids, unreadable_answer)
+
+    missing_answer = "Sorry, the AI model did not return an answer for this question."
+    return {question_id: str(answers_by_id.get(question_id) or missing_answer).strip() for question_id in question_ids}
+
+
+# --- Context Selection (Uses Requests+BS4 for Fetching) ---
+def build_chat_context(user_question, context_token_budget=MAX_CONTEXT_TOKENS, fetch_pages=True):
+    """
+    Selects grant context, fetches web content if needed, and adds internal financial context.
+    context_token_budget caps the grant JSON plus fetched page text; fetch_pages=False skips the live fetch.
+    Returns (context_grants_json_str, fetched_content_status, internal_financial_context_str).
+    """
+    context_grants_json_str = "" # For external grants
+    fetched_content_status = None
+    internal_financial_context_str = "" # For school's own financial data
+
+    target_grant_id = None
+    # Simple check for grant writing help, or questions about district's own finances
+    is_general_request = ("write" in user_question.lower() and "grant" in user_question.lower()) or \
+                         ("budget" in user_question.lower()) or \
+                         ("financial" in user_question.lower() and "district" in user_question.lower()) or \
+                         ("funding need" in user_question.lower())
+
+    # --- Determine Context Strategy ---
+    if not is_general_request: # If specific to external grants
+        mentioned_grant_ids = find_opportunity_ids(user_question, grant_data_by_id)
+        target_grant_id = mentioned_grant_ids[0] if mentioned_grant_ids else None
+        selected_grants_for_context = []
+
+        if target_grant_id:
+            # find_opportunity_ids only returns IDs present in grant_data_by_id, so the grant always exists here
+            print(f"Specific grant ID {target_grant_id} identified. Attempting to fetch details.")
+            specific_grant = grant_data_by_id[target_grant_id]
+            # Compound questions may name several grants; all go in the JSON context, only the first is fetched live
+            selected_grants_for_context = [grant_data_by_id[grant_id] for grant_id in mentioned_grant_ids]
+            grant_link = specific_grant.get("link")
+            if grant_link and not fetch_pages:
+                print(f"Skipping live fetch for grant ID {target_grant_id}; its link is in the grant context.")
+            elif grant_link:
+                fetched_content_raw = fetch_with_requests_bs4(grant_link)
+                print(f"Raw content returned by Requests+BS4: {fetched_content_raw[:100] if fetched_content_raw else 'None'}...")
+                if fetched_content_raw and not fetched_content_raw.startswith("[Error") and not fetched_content_raw.startswith("[No content") and not fetched_content_raw.startswith("[Could not find"):
+                     fetched_content_status = str(fetched_content_raw) # Trimmed to the token budget below
+                     print("Fetched content stored.")
+                elif fetched_content_raw: # It's an error/status message from fetch_with_requests_bs4
+                     print(f"Requests+BS4 fetch failed or returned no content: {fetched_content_raw}")
+                     fetched_content_status = fetched_content_raw
+                else: # Should ideally not happen if fetch function returns error strings
+                     print("Requests+BS4 fetch returned None or empty string unexpectedly.")
+                     fetched_content_status = "[No content returned from fetch attempt.]"
+            else: # No link found for the specific grant
+                print(f"No link found for grant ID {target_grant_id}.")
+                # The mentioned grants' JSON is the whole context; no keyword search needed
+        else: # No specific ID found in question, use keyword search for external grants
+            print("No specific grant ID found in question, using keyword search for context.")
+            selected_grants_for_context = select_relevant_grants_by_keyword(user_question, grant_data, grant_keyword_index) # Pass the global grant_data and its index
+
+        grant_context_tokens = 0
+        if selected_grants_for_context:
+            context_grants_json_str, grant_context_tokens = build_grant_context(selected_grants_for_context, context_token_budget)
+        if fetched_content_status:
+            # Fetched page text gets whatever the grant JSON left of the budget
+            fetched_content_status = truncate_at_line_boundary(fetched_content_status, context_token_budget - grant_context_tokens)
+
+    else: # General request (writing help or about district finances)
+         print("General request detected. Context will primarily be internal financial data if relevant.")
+         # For general writing help, no specific external grant context is needed.
+         # For questions about district finances, only internal financial data is primary.
+
+    # --- Always include Internal Financial Context if available ---
+    internal_financial_context_str = financial_context_str # Pre-serialized at load; empty if unavailable
+
+    return context_grants_json_str, fetched_content_status, internal_financial_context_str
+
+def parse_chat_request():
+    """
+    Returns (user_question, limited_history) from the JSON body, or None if the body or 'question' is missing.
+    limited_history holds the most recent earlier turns only, without the current question,
+    capped at MAX_HISTORY_LENGTH turns and MAX_HISTORY_TOKENS tokens of content.
+    """
+    data = request.get_json()
+    if not isinstance(data, dict) or 'question' not in data:
+        return None
+    user_question = data['question']
+    conversation_history = data.get('history')
+    # Ignore a malformed history (not a list, or entries that are not message objects) instead of failing
+    if not isinstance(conversation_history, list):
+        conversation_history = []
+    elif not all(isinstance(message, dict) for message in conversation_history):
+        conversation_history = [message for message in conversation_history if isinstance(message, dict)]
+    history_end = len(conversation_history)
+    # The frontend appends the question to history before sending; don't send it to the LLM twice
+    if history_end and conversation_history[-1].get('role') == 'user' and conversation_history[-1].get('content') == user_question:
+        history_end -= 1
+    oldest_allowed = max(0, history_end - (MAX_HISTORY_LENGTH * 2 - 1))
+    # Walk back from the newest message so short turns leave room for more history than long ones
+    history_start = history_end
+    history_tokens = 0
+    while history_start > oldest_allowed:
+        message_tokens = count_tokens(str(conversation_history[history_start - 1].get('content') or ''))
+        if history_tokens + message_tokens > MAX_HISTORY_TOKENS:
+            break
+        history_tokens += message_tokens
+        history_start -= 1
+    if history_start > oldest_allowed:
+        print(f"History trimmed to {history_end - history_start} messages ({history_tokens} tokens).")
+    return user_question, conversation_history[history_start:history_end] # One slice, no intermediate copies
+
+
+# --- API Endpoints for Chat ---
 @app.route('/chat', methods=['POST'])
 def chat():
     """Handles incoming chat messages, selects context, fetches web content if needed."""
     try:
-        data = request.get_json()
-        if not data or 'question' not in data:
+        if not data_ready.is_set():
+            return jsonify({"error": "The assistant is still loading grant data. Please try again in a moment."}), 503
+        parsed_request = parse_chat_request()
+        if parsed_request is None:
             return jsonify({"error": "Missing 'question' in request body"}), 400
-
-        user_question = data['question']
-        conversation_history = data.get('history', [])
+        user_question, limited_history = parsed_request
         print(f"Received question: {user_question}")
 
-        context_grants_json_str = "" # For external grants
-        fetched_content_status = None
-        internal_financial_context_str = "" # For school's own financial data
-
-        target_grant_id = None
-        # Simple check for grant writing help, or questions about district's own finances
-        is_general_request = ("write" in user_question.lower() and "grant" in user_question.lower()) or \
-                             ("budget" in user_question.lower()) or \
-                             ("financial" in user_question.lower() and "district" in user_question.lower()) or \
-                             ("funding need" in user_question.lower())
-
-        # --- Determine Context Strategy ---
-        if not is_general_request: # If specific to external grants
-            target_grant_id = find_opportunity_id(user_question, grant_data_by_id)
-            selected_grants_for_context = []
-
-            if target_grant_id:
-                print(f"Specific grant ID {target_grant_id} identified. Attempting to fetch details.")
-                specific_grant = grant_data_by_id.get(target_grant_id)
-                if specific_grant:
-                    selected_grants_for_context = [specific_grant]
-                    grant_link = specific_grant.get("link")
-                    if grant_link:
-                        fetched_content_raw = fetch_with_requests_bs4(grant_link)
-                        print(f"Raw content returned by Requests+BS4: {fetched_content_raw[:100] if fetched_content_raw else 'None'}...")
-                        if fetched_content_raw and not fetched_content_raw.startswith("[Error") and not fetched_content_raw.startswith("[No content") and not fetched_content_raw.startswith("[Could not find"):
-                             fetched_content_status = str(fetched_content_raw)[:MAX_FETCHED_CONTENT_LENGTH]
-                             print(f"Fetched content stored (truncated to {MAX_FETCHED_CONTENT_LENGTH} chars).")
-                        elif fetched_content_raw: # It's an error/status message from fetch_with_requests_bs4
-                             print(f"Requests+BS4 fetch failed or returned no content: {fetched_content_raw}")
-                             fetched_content_status = fetched_content_raw
-                        else: # Should ideally not happen if fetch function returns error strings
-                             print("Requests+BS4 fetch returned None or empty string unexpectedly.")
-                             fetched_content_status = "[No content returned from fetch attempt.]"
-                    else: # No link found for the specific grant
-                        print(f"No link found for grant ID {target_grant_id}.")
-                        # selected_grants_for_context is already [specific_grant] from JSON
-                else: # Grant ID mentioned but not found in our loaded data
-                     print(f"Grant ID {target_grant_id} mentioned but not found in loaded data.")
-                     # Fallback to keyword search if ID not found
-                     selected_grants_for_context = select_relevant_grants_by_keyword(user_question, grant_data) # Pass the global grant_data
-            else: # No specific ID found in question, use keyword search for external grants
-                print("No specific grant ID found in question, using keyword search for context.")
-                selected_grants_for_context = select_relevant_grants_by_keyword(user_question, grant_data) # Pass the global grant_data
-            
-            if selected_grants_for_context:
-                context_grants_json_str = json.dumps(selected_grants_for_context, indent=2)
-
-        else: # General request (writing help or about district finances)
-             print("General request detected. Context will primarily be internal financial data if relevant.")
-             # For general writing help, no specific external grant context is needed.
-             # For questions about district finances, only internal financial data is primary.
-
-        # --- Always include Internal Financial Context if available ---
-        if simulated_financial_data:
-            internal_financial_context_str = json.dumps(simulated_financial_data, indent=2)
-
-
-        # --- Append current question to history ---
-        current_turn_history = conversation_history + [{"role": "user", "content": user_question}]
+        context_grants_json_str, fetched_content_status, internal_financial_context_str = build_chat_context(user_question)
 
         # --- Get Response ---
         bot_response = get_openai_response(
-            current_turn_history,
+            limited_history,
+            user_question,
             context_grants_json_str, # External grant JSON
             fetched_content_status,    # Fetched web content for a specific external grant
             internal_financial_context_str # Internal financial data
@@ -321,11 +808,82 @@ def chat():
         # traceback.print_exc()
         return jsonify({"error": "An internal server error occurred."}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /chat, but streams the answer as plain text so the first words arrive without waiting for the full reply."""
+    try:
+        if not data_ready.is_set():
+            return jsonify({"error": "The assistant is still loading grant data. Please try again in a moment."}), 503
+        parsed_request = parse_chat_request()
+        if parsed_request is None:
+            return jsonify({"error": "Missing 'question' in request body"}), 400
+        user_question, limited_history = parsed_request
+        print(f"Received streaming question: {user_question}")
+
+        context_grants_json_str, fetched_content_status, internal_financial_context_str = build_chat_context(user_question)
+
+        answer_chunks = stream_openai_response(
+            limited_history,
+            user_question,
+            context_grants_json_str,
+            fetched_content_status,
+            internal_financial_context_str
+        )
+        return Response(stream_with_context(answer_chunks), mimetype='text/plain')
+
+    except Exception as e:
+        print(f"Error in /chat/stream endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+@app.route('/chat_batch', methods=['POST'])
+def chat_batch():
+    """
+    Answers several independent questions (no history) in one OpenAI call.
+    Body: {"questions": ["...", ...]}. Response: {"answers": [{"id", "question", "answer"}, ...]} in request order.
+    """
+    try:
+        if not data_ready.is_set():
+            return jsonify({"error": "The assistant is still loading grant data. Please try again in a moment."}), 503
+        data = request.get_json()
+        questions = data.get('questions') if isinstance(data, dict) else None
+        if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+            return jsonify({"error": "'questions' must be a non-empty list of strings"}), 400
+        if len(questions) > MAX_BATCH_QUESTIONS:
+            return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions can be sent in one batch"}), 400
+        print(f"Received batch of {len(questions)} questions.")
+
+        questions_with_context = []
+        internal_financial_context_str = ""
+        # One prompt carries every question, so they share one context budget.
+        # Live page fetches are skipped; run one after another they could outlast the request timeout.
+        per_question_budget = MAX_BATCH_CONTEXT_TOKENS // len(questions)
+        for question_number, question in enumerate(questions, start=1):
+            context_grants_json_str, fetched_content_status, internal_financial_context_str = build_chat_context(question, per_question_budget, fetch_pages=False)
+            questions_with_context.append((str(question_number), question, context_grants_json_str, fetched_content_status))
+
+        answers_by_id = get_openai_batch_answers(questions_with_context, internal_financial_context_str)
+        return jsonify({"answers": [
+            {"id": question_id, "question": question, "answer": answers_by_id[question_id]}
+            for question_id, question, _, _ in questions_with_context
+        ]})
+
+    except Exception as e:
+        print(f"Error in /chat_batch endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred."}), 500
+
 # --- Route for the HTML Frontend ---
+with app.app_context():
+    INDEX_HTML = render_template('index.html') # The page is static, so render it once
+INDEX_ETAG = hashlib.sha256(INDEX_HTML.encode('utf-8')).hexdigest()
+
 @app.route('/')
 def index():
-    """Serves the main HTML page."""
-    return render_template('index.html')
+    """Serves the main HTML page with an ETag and Cache-Control so browsers can reuse it."""
+    response = Response(INDEX_HTML, mimetype='text/html')
+    response.set_etag(INDEX_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = INDEX_CACHE_MAX_AGE
+    return response.make_conditional(request) # 304 Not Modified when If-None-Match matches
 
 # --- Main Execution ---
 if __name__ == '__main__':
@@ -0,0 +1,20 @@
+# Gunicorn settings; run with `gunicorn wsgi:app` from the project root.
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+# Load app.py (and the grant data) once in the master; workers share it copy-on-write
+preload_app = True
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Each worker serves several requests at once while they wait on OpenAI and page fetches
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 120 # OpenAI calls plus a page fetch can take well over the 30 second default
+
+def when_ready(server):
+    # Runs in the master before any worker is forked. With preload_app the app module is already imported,
+    # so wait until its background data load finishes; workers then inherit the loaded data.
+    # Covers every entry point (gunicorn app:app as well as wsgi:app).
+    if server.cfg.preload_app:
+        from app import data_ready
+        data_ready.wait()
@@ -4,6 +4,19 @@ import os
 import glob # Import glob to find files matching a pattern
 import numpy as np
 import re # Import regex module for more flexible searching
+from concurrent.futures import ProcessPoolExecutor # Process CSV files in parallel
+try:
+    import pyarrow as pa # Enables the multithreaded Arrow CSV parser and the Parquet output
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    pa = pa_csv = pq = None
+    CSV_ENGINE = "c"
+try:
+    import orjson # Much faster JSON serialization; falls back to the json module if absent
+except ImportError:
+    orjson = None
 
 # Configuration
 # --- Input ---
@@ -22,6 +35,8 @@ OPPORTUNITY_STATUS_TARGETS = ["posted", "forecasted"] # Include both statuses
 OUTPUT_DIR = "grant_data"
 # Updated output filename to reflect the source pattern
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "independent_school_district_grants_search_combined.json")
+# Columnar copy of the same data; app.py loads it instead of the JSON when pyarrow is installed
+OUTPUT_PARQUET_FILE = os.path.splitext(OUTPUT_FILE)[0] + ".parquet"
 
 # --- CSV Column Mapping (Updated based on user-provided headers) ---
 # Maps the actual CSV header names to the desired JSON keys.
@@ -54,8 +69,96 @@ COLUMN_MAPPING = {
 ELIGIBILITY_COLUMN_NAME = "applicant_types" # Column containing eligibility text
 STATUS_COLUMN_NAME = "opportunity_status"
 OPPORTUNITY_ID_COLUMN = "opportunity_id"
+# Helper column holding the pre-split eligibility codes (no leading underscore, so itertuples keeps the name)
+ELIGIBILITY_CODES_LIST_COLUMN = "eligibility_codes_list"
+# Helper column recording which CSV file each row came from (for warnings after files are combined)
+SOURCE_FILE_COLUMN = "source_csv_path"
 
 
+def read_grants_csv(csv_path):
+    """
+    Reads only the mapped columns of a grants CSV as strings, using the Arrow parser when available.
+    Falls back to the C parser if the Arrow parser rejects the file.
+    Returns None if the file has none of the COLUMN_MAPPING columns.
+    """
+    header_columns = pd.read_csv(csv_path, nrows=0).columns # Header only, to pick the mapped columns
+    mapped_columns = [column for column in header_columns if column in COLUMN_MAPPING]
+    if not mapped_columns:
+        print(f"Warning: None of the expected columns (e.g. '{OPPORTUNITY_ID_COLUMN}') were found in {csv_path}. Skipping this file.")
+        return None
+    if CSV_ENGINE == "pyarrow":
+        try:
+            # Called directly rather than via pandas' engine='pyarrow', which cannot enable newlines_in_values;
+            # most grant descriptions contain line breaks inside quoted fields
+            table = pa_csv.read_csv(
+                csv_path,
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=mapped_columns,
+                    column_types={column: pa.string() for column in mapped_columns},
+                    strings_can_be_null=True, # Empty fields become None, like NaN from the C parser
+                ),
+            )
+            return table.to_pandas()
+        except pa.ArrowInvalid as e:
+            print(f"PyArrow CSV parser failed for {csv_path} ({e}). Retrying with the C parser.")
+    return pd.read_csv(csv_path, dtype=str, on_bad_lines='skip', engine='c', usecols=mapped_columns)
+
+def read_and_filter_csv(csv_path):
+    """
+    Reads one grants CSV and applies the status and eligibility filters.
+    Returns the filtered DataFrame tagged with its source path, or None if the file could not be processed.
+    Runs in a worker process, so it must stay a top-level function.
+    """
+    print(f"\nProcessing file: {csv_path}")
+    try:
+        # Read the CSV file, explicitly setting dtype to str for the mapped columns
+        df = read_grants_csv(csv_path)
+        if df is None:
+            return None
+        print(f"Successfully read {len(df)} rows from {csv_path}.")
+        df_columns = df.columns
+
+        # --- Verify Essential Columns Exist ---
+        if STATUS_COLUMN_NAME not in df_columns:
+             print(f"Warning: Status column '{STATUS_COLUMN_NAME}' not found in {csv_path}. Skipping status filter for this file.")
+             df_filtered = df.copy()
+        else:
+             # Filter by Opportunity Status (case-insensitive, check if status is in the target list)
+             # Fill NaN/None with empty string before filtering
+             # Convert status column to lowercase and check if it's in the list of target statuses
+             status_filter_mask = df[STATUS_COLUMN_NAME].fillna('').str.lower().isin(OPPORTUNITY_STATUS_TARGETS)
+             df_filtered = df[status_filter_mask].copy()
+             # Update log message to reflect multiple statuses
+             print(f"Filtered to {len(df_filtered)} grants with status in {OPPORTUNITY_STATUS_TARGETS}.")
+
+        if ELIGIBILITY_COLUMN_NAME not in df_columns:
+             print(f"Warning: Eligibility column '{ELIGIBILITY_COLUMN_NAME}' not found in {csv_path}. Skipping eligibility filter for this file.")
+        else:
+             # Filter by Eligibility Text (case-insensitive substring search)
+             target_text = str(ELIGIBILITY_TEXT_TARGET)
+             # Fill NaN/None with empty string before applying string operations
+             eligibility_mask = df_filtered[ELIGIBILITY_COLUMN_NAME].fillna('').astype(str).str.contains(target_text, case=False, regex=False, na=False)
+             df_filtered = df_filtered[eligibility_mask].copy()
+             print(f"Filtered to {len(df_filtered)} grants potentially matching eligibility text '{ELIGIBILITY_TEXT_TARGET}' in '{ELIGIBILITY_COLUMN_NAME}'.")
+
+        if OPPORTUNITY_ID_COLUMN not in df_columns:
+            print(f"Warning: Opportunity ID column '{OPPORTUNITY_ID_COLUMN}' not found in {csv_path}. Deduplication might not work correctly for this file.")
+
+        return df_filtered.assign(**{SOURCE_FILE_COLUMN: csv_path})
+
+    except FileNotFoundError:
+        print(f"Error: CSV file not found at {csv_path}")
+        return None
+    except pd.errors.EmptyDataError:
+        print(f"Error: CSV file is empty: {csv_path}")
+        return None
+    except Exception as e:
+        print(f"An unexpected error occurred during processing {csv_path}: {e}")
+        import traceback
+        traceback.print_exc() # Print detailed traceback for debugging
+        return None
+
 def process_grants_search_csvs(csv_pattern):
     """
     Finds CSV files matching a pattern, reads grant data, filters, combines,
@@ -70,117 +173,93 @@ def process_grants_search_csvs(csv_pattern):
     for f in csv_files:
         print(f"- {f}")
 
+    # Files are independent and parsing is CPU-bound, so read them in parallel.
+    # executor.map keeps file order, so deduplication below still keeps the first occurrence.
+    if len(csv_files) == 1:
+        file_frames = [read_and_filter_csv(csv_files[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(csv_files), os.cpu_count() or 1)) as executor:
+            file_frames = list(executor.map(read_and_filter_csv, csv_files))
+    filtered_frames = [frame for frame in file_frames if frame is not None]
+
+    if not filtered_frames:
+        print("\nNo grants were read from any file.")
+        return []
+
+    # --- Deduplication (vectorized across all files; the first occurrence in file order wins) ---
+    combined_df = pd.concat(filtered_frames) # Keeps each file's row labels for the warnings below
+    combined_columns = combined_df.columns
+    if OPPORTUNITY_ID_COLUMN in combined_columns:
+        combined_df[OPPORTUNITY_ID_COLUMN] = combined_df[OPPORTUNITY_ID_COLUMN].str.strip()
+        # Rows without an ID are kept here so the loop below can report and skip them
+        has_opportunity_id = combined_df[OPPORTUNITY_ID_COLUMN].fillna('') != ''
+        combined_df = combined_df[~has_opportunity_id | ~combined_df.duplicated(subset=[OPPORTUNITY_ID_COLUMN], keep='first')].copy()
+        print(f"\n{len(combined_df)} grants remain after removing duplicate '{OPPORTUNITY_ID_COLUMN}' values across files.")
+
+    # --- Data Transformation ---
+    print(f"Processing {len(combined_df)} filtered grants...")
     all_relevant_grants = []
-    processed_opportunity_ids = set() # Keep track of processed IDs for deduplication
+    # Split eligibility codes for all rows at once (semicolon separated, based on user example)
+    if ELIGIBILITY_COLUMN_NAME in combined_columns:
+        combined_df[ELIGIBILITY_CODES_LIST_COLUMN] = combined_df[ELIGIBILITY_COLUMN_NAME].str.split(';').map(
+            lambda codes: [code.strip() for code in codes if code.strip()] if isinstance(codes, list) else None
+        )
+    # itertuples avoids building a Series per row like iterrows does
+    for row in combined_df.itertuples(index=True, name="Row"):
+        index = row.Index
+        csv_path = getattr(row, SOURCE_FILE_COLUMN)
+        grant_details = {}
+        opportunity_id = None
 
-    for csv_path in csv_files:
-        print(f"\nProcessing file: {csv_path}")
-        try:
-            # Read the CSV file, explicitly setting dtype to str for all columns initially
-            df = pd.read_csv(csv_path, dtype=str, on_bad_lines='skip')
-            print(f"Successfully read {len(df)} rows from {csv_path}.")
-            df_columns = df.columns
-
-            # --- Verify Essential Columns Exist ---
-            if STATUS_COLUMN_NAME not in df_columns:
-                 print(f"Warning: Status column '{STATUS_COLUMN_NAME}' not found in {csv_path}. Skipping status filter for this file.")
-                 df_filtered = df.copy()
-            else:
-                 # Filter by Opportunity Status (case-insensitive, check if status is in the target list)
-                 # Fill NaN/None with empty string before filtering
-                 # Convert status column to lowercase and check if it's in the list of target statuses
-                 status_filter_mask = df[STATUS_COLUMN_NAME].fillna('').str.lower().isin(OPPORTUNITY_STATUS_TARGETS)
-                 df_filtered = df[status_filter_mask].copy()
-                 # Update log message to reflect multiple statuses
-                 print(f"Filtered to {len(df_filtered)} grants with status in {OPPORTUNITY_STATUS_TARGETS}.")
-
-            if ELIGIBILITY_COLUMN_NAME not in df_columns:
-                 print(f"Warning: Eligibility column '{ELIGIBILITY_COLUMN_NAME}' not found in {csv_path}. Skipping eligibility filter for this file.")
+        # Map columns based on the updated COLUMN_MAPPING
+        for csv_col, json_key in COLUMN_MAPPING.items():
+            if csv_col in combined_columns: # Check if the source column exists
+                value = getattr(row, csv_col)
+                # Convert potential pandas/numpy NaN/NaT to None for JSON
+                if pd.isna(value):
+                     grant_details[json_key] = None
+                else:
+                     grant_details[json_key] = str(value).strip() # Ensure string and strip whitespace
+
+                # Store opportunity ID for the link and missing-ID checks
+                if csv_col == OPPORTUNITY_ID_COLUMN:
+                    opportunity_id = grant_details[json_key]
             else:
-                 # Filter by Eligibility Text (case-insensitive substring search)
-                 target_text = str(ELIGIBILITY_TEXT_TARGET)
-                 # Fill NaN/None with empty string before applying string operations
-                 eligibility_mask = df_filtered[ELIGIBILITY_COLUMN_NAME].fillna('').astype(str).str.contains(target_text, case=False, regex=False, na=False)
-                 df_filtered = df_filtered[eligibility_mask].copy()
-                 print(f"Filtered to {len(df_filtered)} grants potentially matching eligibility text '{ELIGIBILITY_TEXT_TARGET}' in '{ELIGIBILITY_COLUMN_NAME}'.")
-
-            if OPPORTUNITY_ID_COLUMN not in df_columns:
-                print(f"Warning: Opportunity ID column '{OPPORTUNITY_ID_COLUMN}' not found in {csv_path}. Deduplication might not work correctly for this file.")
-
-            # --- Data Transformation ---
-            print(f"Processing {len(df_filtered)} filtered grants from {csv_path}...")
-            for index, row in df_filtered.iterrows():
-                grant_details = {}
-                opportunity_id = None
-
-                # Map columns based on the updated COLUMN_MAPPING
-                for csv_col, json_key in COLUMN_MAPPING.items():
-                    if csv_col in df_columns: # Check if the source column exists
-                        value = row[csv_col]
-                        # Convert potential pandas/numpy NaN/NaT to None for JSON
-                        if pd.isna(value):
-                             grant_details[json_key] = None
-                        else:
-                             grant_details[json_key] = str(value).strip() # Ensure string and strip whitespace
-
-                        # Store opportunity ID for deduplication check
-                        if csv_col == OPPORTUNITY_ID_COLUMN:
-                            opportunity_id = grant_details[json_key]
-                    else:
-                        grant_details[json_key] = None # Assign None if source column doesn't exist
-
-                # Skip if OpportunityID is missing or empty after stripping
-                if not opportunity_id:
-                     opp_id_value_raw = row.get(OPPORTUNITY_ID_COLUMN) # Get raw value
-                     if pd.isna(opp_id_value_raw) or not str(opp_id_value_raw).strip():
-                          print(f"Warning: Skipping row {index+2} in {csv_path} due to missing or empty '{OPPORTUNITY_ID_COLUMN}'.")
-                          continue
-                     else: # Attempt to recover if mapping failed but column has value
-                          opportunity_id = str(opp_id_value_raw).strip()
-                          if "opportunityID" not in grant_details or not grant_details["opportunityID"]:
-                              grant_details["opportunityID"] = opportunity_id
-
-                # Final check on opportunity_id before deduplication check
-                if not opportunity_id:
-                     print(f"Warning: Still skipping row {index+2} in {csv_path} after attempting to recover OpportunityID.")
-                     continue
-
-                # Deduplication check
-                if opportunity_id in processed_opportunity_ids:
-                    continue # Skip duplicate
-
-                # Special handling for eligibility codes/text: Split the text field
-                eligibility_value = grant_details.get("eligibilityCodes") # This now holds the text string
-                if eligibility_value and isinstance(eligibility_value, str):
-                     # Using semicolon based on user example
-                     codes = [code.strip() for code in pd.Series(eligibility_value).str.split(';').explode().tolist() if code.strip()]
-                     grant_details["eligibilityCodes"] = codes if codes else []
-                elif "eligibilityCodes" not in grant_details: # Ensure key exists
-                     grant_details["eligibilityCodes"] = []
-
-
-                # Generate link using the opportunity ID
-                grant_details["link"] = f"https://simpler.grants.gov/opportunity/{opportunity_id}" if opportunity_id else None
-
-                # Ensure all target JSON keys exist, even if the source column was missing
-                for mapped_csv_col, json_key in COLUMN_MAPPING.items():
-                    if json_key not in grant_details:
-                        grant_details[json_key] = None
-
-                all_relevant_grants.append(grant_details)
-                processed_opportunity_ids.add(opportunity_id) # Add ID to set for deduplication
-
-        except FileNotFoundError:
-            print(f"Error: CSV file not found at {csv_path}")
-            continue
-        except pd.errors.EmptyDataError:
-            print(f"Error: CSV file is empty: {csv_path}")
-            continue
-        except Exception as e:
-            print(f"An unexpected error occurred during processing {csv_path}: {e}")
-            import traceback
-            traceback.print_exc() # Print detailed traceback for debugging
-            continue
+                grant_details[json_key] = None # Assign None if source column doesn't exist
+
+        # Skip if OpportunityID is missing or empty after stripping
+        if not opportunity_id:
+             opp_id_value_raw = getattr(row, OPPORTUNITY_ID_COLUMN, None) # Get raw value
+             if pd.isna(opp_id_value_raw) or not str(opp_id_value_raw).strip():
+                  print(f"Warning: Skipping row {index+2} in {csv_path} due to missing or empty '{OPPORTUNITY_ID_COLUMN}'.")
+                  continue
+             else: # Attempt to recover if mapping failed but column has value
+                  opportunity_id = str(opp_id_value_raw).strip()
+                  if "opportunityID" not in grant_details or not grant_details["opportunityID"]:
+                      grant_details["opportunityID"] = opportunity_id
+
+        # Final check on opportunity_id
+        if not opportunity_id:
+             print(f"Warning: Still skipping row {index+2} in {csv_path} after attempting to recover OpportunityID.")
+             continue
+
+        # Special handling for eligibility codes/text: use the list split above the loop
+        eligibility_codes = getattr(row, ELIGIBILITY_CODES_LIST_COLUMN, None)
+        if eligibility_codes is not None:
+             grant_details["eligibilityCodes"] = eligibility_codes
+        elif "eligibilityCodes" not in grant_details: # Ensure key exists
+             grant_details["eligibilityCodes"] = []
+
+
+        # Generate link using the opportunity ID
+        grant_details["link"] = f"https://simpler.grants.gov/opportunity/{opportunity_id}" if opportunity_id else None
+
+        # Ensure all target JSON keys exist, even if the source column was missing
+        for mapped_csv_col, json_key in COLUMN_MAPPING.items():
+            if json_key not in grant_details:
+                grant_details[json_key] = None
+
+        all_relevant_grants.append(grant_details)
 
     print(f"\nProcessing complete. Total unique relevant grants found across all files: {len(all_relevant_grants)}")
     return all_relevant_grants
@@ -192,19 +271,39 @@ def save_data_to_json(data, filename):
         return
     try:
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        if orjson is not None:
+            # orjson writes UTF-8 bytes directly; OPT_SERIALIZE_NUMPY covers any numpy values left by pandas
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2) # Same layout as the orjson output
         print(f"Successfully saved data to {filename}")
     except IOError as e:
         print(f"Error saving data to file {filename}: {e}")
     except Exception as e:
         print(f"An unexpected error occurred during saving: {e}")
 
+def save_data_to_parquet(data, filename):
+    """Saves the provided data list to a zstd-compressed Parquet file, if pyarrow is installed."""
+    if not data:
+        return
+    if pq is None:
+        print("pyarrow is not installed; skipping Parquet output.")
+        return
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        pq.write_table(pa.Table.from_pylist(data), filename, compression="zstd")
+        print(f"Successfully saved data to {filename}")
+    except Exception as e:
+        print(f"An unexpected error occurred saving Parquet file {filename}: {e}")
+
 # --- Main Execution ---
 if __name__ == "__main__":
     # Pass the pattern to the processing function
     extracted_grants = process_grants_search_csvs(CSV_PATTERN)
     if extracted_grants:
         save_data_to_json(extracted_grants, OUTPUT_FILE)
+        save_data_to_parquet(extracted_grants, OUTPUT_PARQUET_FILE)
     else:
         print("No grant data was processed or saved.")
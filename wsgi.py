@@ -0,0 +1,6 @@
+"""WSGI entry point for production servers, e.g. `gunicorn wsgi:app` (settings in gunicorn.conf.py)."""
+from app import app, data_ready
+
+# app.py loads the grant data on a background thread. Wait for it so servers that fork workers after
+# importing this module hand them the loaded data (gunicorn.conf.py's when_ready hook does the same for app:app).
+data_ready.wait()